@@ -1,7 +1,7 @@
 import numpy
+from bisect import bisect_right
 from scipy.integrate import quad
 from summer_py.summer_model import order_dict_by_keys, add_zero_to_age_breakpoints
-from copy import copy
 
 
 """
@@ -51,20 +51,6 @@ def get_average_value_of_function(input_function, start_value, end_value):
     return quad(input_function, start_value, end_value)[0] / (end_value - start_value)
 
 
-def get_parameter_dict_from_function(input_function, breakpoints, upper_value=100.0):
-    """
-    create a dictionary of parameter values from a continuous function, an arbitrary upper value and some breakpoints
-    within which to evaluate the function
-    """
-    revised_breakpoints = copy.copy(add_zero_to_age_breakpoints(breakpoints))
-    revised_breakpoints.append(upper_value)
-    param_values = []
-    for n_breakpoint in range(len(revised_breakpoints) - 1):
-        param_values.append(get_average_value_of_function(
-            input_function, revised_breakpoints[n_breakpoint], revised_breakpoints[n_breakpoint + 1]))
-    return {str(key): value for key, value in zip(revised_breakpoints, param_values)}
-
-
 def substratify_parameter(parameter_to_stratify, stratum_to_split, param_value_dict, breakpoints, stratification="age"):
     """
     produce dictionary revise a stratum of a parameter that has been split at a higher level from dictionary of the
@@ -100,8 +86,7 @@ def get_parameter_dict_from_function(input_function, breakpoints, upper_value=10
     create a dictionary of parameter values from a continuous function, an arbitrary upper value and some breakpoints
         within which to evaluate the function
     """
-    revised_breakpoints = copy(add_zero_to_age_breakpoints(breakpoints))
-    revised_breakpoints.append(upper_value)
+    revised_breakpoints = add_zero_to_age_breakpoints(breakpoints) + [upper_value]
     param_values = []
     for n_breakpoint in range(len(revised_breakpoints) - 1):
         param_values.append(get_average_value_of_function(
@@ -122,13 +107,9 @@ def create_step_function_from_dict(input_dict):
     """
     dict_keys, dict_values = order_dict_by_keys(input_dict)
 
+    # binary search for the last step at or below the input value, with values below the first step taking its value
     def step_function(input_value):
-        if input_value >= dict_keys[-1]:
-            return dict_values[-1]
-        else:
-            for key in range(len(dict_keys)):
-                if input_value < dict_keys[key + 1]:
-                    return dict_values[key]
+        return dict_values[max(bisect_right(dict_keys, input_value) - 1, 0)]
 
     return step_function
 
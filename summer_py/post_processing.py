@@ -1,5 +1,5 @@
 import summer_py.summer_model as sm
-from numpy import linspace
+import numpy
 
 
 def find_first_list_element_above(a_list, value):
@@ -91,6 +91,10 @@ class PostProcessing:
           output of interest. With the example above, we are interested in individuals who have latent infection with a
           MDR strain.
         """
+
+        # split each compartment name into its stratification components once, rather than once for every output
+        compartment_components = [sm.find_name_components(compartment) for compartment in self.model.compartment_names]
+
         for output in self.requested_outputs:
             self.operations_to_perform[output] = {}
             if output[0:4] == "prev":
@@ -116,7 +120,7 @@ class PostProcessing:
                 self.operations_to_perform[output]['denominator_extra_indices'] = []  # to be added to the numerator ones to form the whole denominator
                 for j, compartment in enumerate(self.model.compartment_names):
                     is_relevant = True
-                    name_components = sm.find_name_components(compartment)
+                    name_components = compartment_components[j]
                     for condition in conditions.keys():  # for each stratification
                         if not any(category in name_components for category in conditions[condition]):
                             is_relevant = False
@@ -134,8 +138,7 @@ class PostProcessing:
                 for stratum_name in self.model.all_stratifications[stratification_of_interest]:
                     self.operations_to_perform[output]['compartment_indices'][stratum_name] = []
                     keyword = stratification_of_interest + '_' + stratum_name
-                    for j, compartment_name in enumerate(self.model.compartment_names):
-                        name_components = sm.find_name_components(compartment_name)
+                    for j, name_components in enumerate(compartment_components):
                         if keyword in name_components:
                             self.operations_to_perform[output]['compartment_indices'][stratum_name].append(j)
             else:
@@ -167,27 +170,24 @@ class PostProcessing:
         """
 
         if self.operations_to_perform[output]['operation'] == 'division':
-            out = []
-            for i in time_indices:
-                numerator = self.model.outputs[i, self.operations_to_perform[output]['numerator_indices']].sum()
-                extra_for_denominator =\
-                    self.model.outputs[i, self.operations_to_perform[output]['denominator_extra_indices']].sum()
-                if numerator + extra_for_denominator == 0:
-                    q = 0
-                else:
-                    q = numerator / (numerator + extra_for_denominator)
-                if output in self.multipliers.keys():
-                    q *= self.multipliers[output]
-                out.append(q)
+
+            # reduce over all the requested times at once, rather than summing compartments time point by time point
+            selected_outputs = self.model.outputs[list(time_indices), :]
+            numerators = selected_outputs[:, self.operations_to_perform[output]['numerator_indices']].sum(axis=1)
+            denominators = numerators + \
+                selected_outputs[:, self.operations_to_perform[output]['denominator_extra_indices']].sum(axis=1)
+            out = numpy.divide(numerators, denominators, out=numpy.zeros(len(numerators)), where=denominators != 0.)
+            if output in self.multipliers.keys():
+                out *= self.multipliers[output]
+            out = out.tolist()
 
         elif self.operations_to_perform[output]['operation'] == 'sum_across_compartments':
+            # select the requested times once and then reduce over the compartments of each stratum in a single pass
+            selected_outputs = self.model.outputs[list(time_indices), :]
             out = {}
             for stratum in self.operations_to_perform[output]['compartment_indices'].keys():
-                out[stratum] = []
-                for i in time_indices:
-                    out[stratum].append(
-                        self.model.outputs[i, self.operations_to_perform[output]['compartment_indices'][stratum]].sum()
-                    )
+                out[stratum] = selected_outputs[
+                    :, self.operations_to_perform[output]['compartment_indices'][stratum]].sum(axis=1).tolist()
         else:
             ValueError("Operation" + self.operations_to_perform[output]['operation'] + " is not supported")
 
@@ -219,7 +219,7 @@ class PostProcessing:
 if __name__ == "__main__":
     # build and run an example model
     sir_model = sm.StratifiedModel(
-        linspace(0, 60 / 365, 61).tolist(),
+        numpy.linspace(0, 60 / 365, 61).tolist(),
         ["susceptible", "infectious", "recovered"],
         {"infectious": 0.001},
         {"beta": 400, "recovery": 365 / 13, "infect_death": 1},
@@ -1,11 +1,10 @@
 import numpy
-from scipy.integrate import odeint, solve_ivp
-import matplotlib.pyplot
-import copy
+from scipy.integrate import odeint, solve_ivp, ode
 import pandas as pd
 from graphviz import Digraph
 import os
 import itertools
+from functools import lru_cache
 from sqlalchemy import create_engine
 
 
@@ -91,21 +90,36 @@ def find_stem(stratified_string, joining_string="X"):
     return stratified_string[:index]
 
 
-def find_name_components(compartment):
+@lru_cache(maxsize=None)
+def find_name_components_as_tuple(compartment):
     """
     extract all the components of a stratified compartment or parameter name, including the stem
+    results are cached, because the same names are split repeatedly during model construction and integration and
+        by every model built with the same structure
 
     :param compartment: str
         name of the compartment or parameter to be interrogated
-    :return: list
-        the extracted compartment components
+    :return: tuple
+        the extracted compartment components, as a tuple so that the cached value cannot be modified
     """
 
     # add -1 at the start, which becomes zero to represent the start when one is added
     x_positions = [-1] + extract_x_positions(compartment)
 
     # add one to the first index to go past the joining character, but not at the end
-    return [compartment[x_positions[x_pos] + 1: x_positions[x_pos + 1]] for x_pos in range(len(x_positions) - 1)]
+    return tuple(compartment[x_positions[x_pos] + 1: x_positions[x_pos + 1]] for x_pos in range(len(x_positions) - 1))
+
+
+def find_name_components(compartment):
+    """
+    extract all the components of a stratified compartment or parameter name, including the stem
+
+    :param compartment: str
+        name of the compartment or parameter to be interrogated
+    :return: list
+        the extracted compartment components
+    """
+    return list(find_name_components_as_tuple(compartment))
 
 
 def find_stratum_index_from_string(compartment, stratification, remove_stratification_name=True):
@@ -240,12 +254,12 @@ def add_zero_to_age_breakpoints(breakpoints):
     """
     append a zero on to a list if there isn't one already present, for the purposes of age stratification
 
-    :param breakpoints: list
+    :param breakpoints: list or tuple
         integers for the age breakpoints requested
     :return: list
-        age breakpoints with the zero value included
+        new list of the age breakpoints with the zero value included, so the request itself is never modified
     """
-    return [0] + breakpoints if 0 not in breakpoints else breakpoints
+    return [0] + list(breakpoints) if 0 not in breakpoints else list(breakpoints)
 
 
 def split_age_parameter(age_breakpoints, parameter):
@@ -295,6 +309,29 @@ def create_time_variant_multiplicative_function(time_variant_function):
     return lambda input_value, time: time_variant_function(time) * input_value
 
 
+def create_product_function(base_function, time_variant_functions, multiplier):
+    """
+    combine a function of time with any number of time-variant multipliers and a fixed multiplier into one function,
+        rather than nesting a function of function for each component, so that only one call is made when evaluated
+
+    :param base_function: function
+        function of time that gives the value before any adjustments are applied
+    :param time_variant_functions: list
+        functions of time that return the values the base value should be multiplied by, applied in order
+    :param multiplier: float
+        fixed value that the result is multiplied by after the time-variant adjustments
+    :return: function
+        function that returns the product of all of these components at the time requested
+    """
+    def product_function(time):
+        value = base_function(time)
+        for time_variant_function in time_variant_functions:
+            value = time_variant_function(time) * value
+        return multiplier * value
+
+    return product_function
+
+
 def create_additive_function(increment):
     """
     return the addition of a fixed value as a function
@@ -416,12 +453,25 @@ def create_flowchart(model_object, strata=None, name="flow_chart"):
     model_object.flow_diagram.render(name)
 
 
+@lru_cache(maxsize=None)
+def get_database_engine(database_name):
+    """
+    create the engine to connect to an sql database, which is cached so that only one engine (and connection pool) is
+        created for each database, however many times outputs are stored to it
+
+    :param database_name: str
+        path to the sqlite database file
+    :return: sqlalchemy engine
+        engine connected to the requested database
+    """
+    return create_engine("sqlite:///" + database_name, echo=False)
+
+
 def store_database(outputs, table_name="outputs",  database_name="../databases/outputs.db", append=True):
     """
     store outputs from the model in sql database for use in producing outputs later
     """
-    engine = create_engine("sqlite:///" + database_name, echo=False)
-    outputs.to_sql(table_name, con=engine, if_exists="append",  index=False)
+    outputs.to_sql(table_name, con=get_database_engine(database_name), if_exists="append",  index=False)
 
 
 class EpiModel:
@@ -436,6 +486,9 @@ class EpiModel:
     :attribute birth_approach: str
         approach to allowing entry flows into the model
         currently must be add_crude_birth_rate, replace_deaths or no_births
+    :attribute compartment_indices: dict
+        keys are the compartment names, values their positions within compartment_names, found before integration so
+            that compartments can be looked up without searching through the list of names
     :attribute compartment_names: list
         list of the strings representing the model compartments
     :attribute compartment_types: list
@@ -447,6 +500,9 @@ class EpiModel:
         user-defined functions that calculate specific model quantities that are needed to determine the rate of
             specific flows - for example, transitions that need to be implemented as absolute rates regardless of the
             size of the origin compartment
+    :attribute death_flow_columns: dict
+        contents of death_flows extracted before integration, with keys the column names and values dictionaries keyed
+            by flow index, so that flow characteristics can be read during integration without pandas indexing
     :attribute death_flows: pandas data frame
         grid containing the information for the compartment-specific death flows to be implemented
         columns are type, parameter, origin, implement
@@ -478,7 +534,7 @@ class EpiModel:
             initial_conditions argument
     :attribute integration_type: str
         integration approach for numeric solution to odes
-        currently must be odeint or solveivp, but will likely be extended as this module is developed
+        currently must be odeint, solve_ivp or dopri5, but will likely be extended as this module is developed
     :attribute output_connections: dict
         keys are the names of the quantities to be tracked
         value is dict containing the origin and the destination ("to") compartments on which to base these calculations
@@ -497,18 +553,27 @@ class EpiModel:
         optional name of the compartment to add population recruitment to
     :attribute starting_population: numeric (int or float)
         value for the total starting population to be supplemented to if initial_conditions_to_total requested
+    :attribute stored_state: tuple
+        copies of the starting compartment values, parameters and time-variant functions stored by snapshot_state, so
+            that the model can be returned to its pre-integration state for repeated runs
     :attribute time_variants: dict
         keys parameter names, values functions with independent variable being time and returning parameter value
-    :attribute times: list
+    :attribute times: list or numpy.ndarray
         time steps at which outputs are to be evaluated
     :attribute tracked_quantities: dict
         keys tracked quantities, which are also the keys of output_connections and derived_outputs
         values are the current working value for this quantity during integration
+    :attribute transition_flow_columns: dict
+        contents of transition_flows extracted before integration, in the same format as death_flow_columns
     :attribute transition_flows: pandas data frame
         grid containing the information for the inter-compartmental transition flows to be implemented
         columns are type, parameter, origin, to, implement, strain
     :attribute transition_indices_to_implement: list
         indices of the transition indices to be implemented because applicable to the final level of stratification
+    :attribute transition_origin_indices: numpy array
+        integer compartment indices of the origin of each transition flow in transition_indices_to_implement
+    :attribute transition_to_indices: numpy array
+        integer compartment indices of the destination of each transition flow in transition_indices_to_implement
     :attribute unstratified_flows:
     :attribute verbose: bool
         whether to output progress in model construction as this process proceeds
@@ -571,7 +636,9 @@ class EpiModel:
             self.starting_compartment, self.equilibrium_stopping_tolerance, self.outputs, self.integration_type, \
             self.output_connections, self.infectious_populations, self.infectious_denominators, \
             self.derived_output_functions, self.transition_indices_to_implement, self.death_indices_to_implement, \
-            self.death_output_categories, self.ticker, self.change_indices_to_implement = (None for _ in range(25))
+            self.death_output_categories, self.ticker, self.change_indices_to_implement, self.stored_state, \
+            self.transition_origin_indices, self.transition_to_indices, self.compartment_indices, \
+            self.transition_flow_columns, self.death_flow_columns = (None for _ in range(31))
 
         # for storing derived output in db
         self.step = 0
@@ -586,7 +653,7 @@ class EpiModel:
             setattr(self, attribute, eval(attribute))
 
         # keep copy of the compartment types in case the compartment names are stratified later
-        self.compartment_names = copy.copy(self.compartment_types)
+        self.compartment_names = list(self.compartment_types)
 
         # set initial conditions and implement flows
         self.set_initial_conditions(initial_conditions_to_total)
@@ -619,9 +686,11 @@ class EpiModel:
         for expected_float_variable in ("_equilibrium_stopping_tolerance",):
             if not isinstance(eval(expected_float_variable), float):
                 raise TypeError("expected float for %s" % expected_float_variable)
-        for expected_list in ("_times", "_compartment_types", "_requested_flows"):
+        for expected_list in ("_compartment_types", "_requested_flows"):
             if not isinstance(eval(expected_list), list):
                 raise TypeError("expected list for %s" % expected_list)
+        if not isinstance(_times, (list, numpy.ndarray)):
+            raise TypeError("expected list or numpy array for _times")
         for expected_tuple in ("_infectious_compartment", "_death_output_categories"):
             if not isinstance(eval(expected_tuple), tuple):
                 raise TypeError("expected tuple for %s" % expected_tuple)
@@ -640,9 +709,9 @@ class EpiModel:
             ValueError("infectious compartment name is not one of the listed compartment types")
         if _birth_approach not in ("add_crude_birth_rate", "replace_deaths", "no_births"):
             ValueError("requested birth approach unavailable")
-        if sorted(_times) != _times:
+        if any(numpy.diff(_times) < 0.):
             self.output_to_user("requested integration times are not sorted, now sorting")
-            self.times = sorted(self.times)
+            self.times = numpy.sort(self.times) if isinstance(self.times, numpy.ndarray) else sorted(self.times)
         for output in _output_connections:
             if any(item not in ("origin", "to", "origin_condition", "to_condition") for item in _output_connections[output]):
                 raise ValueError("output connections incorrect specified, need an 'origin' and possibly 'to'," 
@@ -814,10 +883,23 @@ class EpiModel:
         primarily for use in the stratified version when over-written
         here just find all of the compartments that are infectious and prepare some list indices to speed integration
         """
+        self.compartment_indices = self.find_compartment_indices()
+        self.transition_flow_columns, self.death_flow_columns = \
+            self.transition_flows.to_dict(), self.death_flows.to_dict()
         self.infectious_indices = self.find_all_infectious_indices()
         self.transition_indices_to_implement = self.find_transition_indices_to_implement()
+        self.transition_origin_indices, self.transition_to_indices = self.find_transition_compartment_indices()
         self.death_indices_to_implement = self.find_death_indices_to_implement()
 
+    def find_compartment_indices(self):
+        """
+        map each compartment name to its position in the compartment_names list
+
+        :return: dict
+            see compartment_indices attribute
+        """
+        return {compartment: i_comp for i_comp, compartment in enumerate(self.compartment_names)}
+
     def find_all_infectious_indices(self):
         """
         find all the compartment names that begin with one of the requested infectious compartments
@@ -838,6 +920,20 @@ class EpiModel:
         """
         return list(range(len(self.transition_flows)))
 
+    def find_transition_compartment_indices(self):
+        """
+        find the compartment indices that each transition flow to be implemented moves people from and to, so that the
+            net flows can be applied to the odes all at once during integration
+
+        :return: tuple
+            two numpy arrays of integers for the origin and destination compartments, in the same order as
+                transition_indices_to_implement
+        """
+        return tuple(
+            numpy.array([self.compartment_indices[self.transition_flows[column][n_flow]]
+                         for n_flow in self.transition_indices_to_implement], dtype=int)
+            for column in ("origin", "to"))
+
     def find_death_indices_to_implement(self):
         """
         for over-writing in stratified version, here just returns the indices of all the transition flows, as they all
@@ -863,7 +959,8 @@ class EpiModel:
         if self.integration_type == "odeint":
             def make_model_function(compartment_values, time):
                 self.update_tracked_quantities(compartment_values)
-                return self.apply_all_flow_types_to_odes([0.0] * len(self.compartment_names), compartment_values, time)
+                return self.apply_all_flow_types_to_odes(
+                    numpy.zeros(len(self.compartment_names)), compartment_values, time)
 
             self.outputs = odeint(make_model_function, self.compartment_values, self.times, atol=1.e-3, rtol=1.e-3)
 
@@ -873,14 +970,15 @@ class EpiModel:
             # solve_ivp requires arguments to model function in the reverse order
             def make_model_function(time, compartment_values):
                 self.update_tracked_quantities(compartment_values)
-                return self.apply_all_flow_types_to_odes([0.0] * len(self.compartment_names), compartment_values, time)
+                return self.apply_all_flow_types_to_odes(
+                    numpy.zeros(len(self.compartment_names)), compartment_values, time)
 
             # add a stopping condition, which was the original purpose of using this integration approach
             def set_stopping_conditions(time, compartment_values):
                 self.update_tracked_quantities(compartment_values)
-                return max(list(map(abs, self.apply_all_flow_types_to_odes(
-                    [0.0] * len(self.compartment_names), compartment_values, time)))) - \
-                       self.equilibrium_stopping_tolerance
+                return numpy.abs(self.apply_all_flow_types_to_odes(
+                    numpy.zeros(len(self.compartment_names)), compartment_values, time)).max() - \
+                    self.equilibrium_stopping_tolerance
             set_stopping_conditions.terminal = True
 
             # solve_ivp returns more detailed structure, with (transposed) outputs (called "y") being just one component
@@ -889,6 +987,22 @@ class EpiModel:
                 (self.times[0], self.times[-1]), self.compartment_values, t_eval=self.times,
                 events=set_stopping_conditions)["y"].transpose()
 
+        # explicit runge-kutta method through the ode interface, which has less overhead per step than solve_ivp
+        elif self.integration_type == "dopri5":
+            def make_model_function(time, compartment_values):
+                self.update_tracked_quantities(compartment_values)
+                return self.apply_all_flow_types_to_odes(
+                    numpy.zeros(len(self.compartment_names)), compartment_values, time)
+
+            integrator = ode(make_model_function).set_integrator("dopri5", atol=1.e-3, rtol=1.e-3, nsteps=100000)
+            integrator.set_initial_value(self.compartment_values, self.times[0])
+            self.outputs = numpy.zeros((len(self.times), len(self.compartment_names)))
+            self.outputs[0, :] = self.compartment_values
+            for n_time, time in enumerate(self.times[1:], 1):
+                self.outputs[n_time, :] = integrator.integrate(time)
+                if not integrator.successful():
+                    raise ValueError("dopri5 integration failed at time %s" % time)
+
         else:
             raise ValueError("integration approach requested not available")
 
@@ -904,6 +1018,33 @@ class EpiModel:
         for death_output in self.death_output_categories:
             self.calculate_post_integration_death_outputs(death_output)
 
+    def snapshot_state(self):
+        """
+        store copies of the quantities that may be changed between repeated runs of a model with the same structure
+            (e.g. during calibration), so that the model can be re-run without being rebuilt or deep-copied
+        should be called once the model has been fully constructed and stratified, but before it is run
+        """
+        self.stored_state = \
+            (list(self.compartment_values), dict(self.parameters), dict(self.time_variants))
+
+    def restore_state(self):
+        """
+        write the quantities stored by snapshot_state back into the model in-place and clear the outputs of any
+            previous integration
+        note that post-integration output calculations over-write the compartment values, so this is needed before
+            any subsequent call to run_model
+        """
+        if self.stored_state is None:
+            raise ValueError("model state must be stored with snapshot_state before it can be restored")
+        compartment_values, parameters, time_variants = self.stored_state
+        self.compartment_values = list(compartment_values)
+        self.parameters.clear()
+        self.parameters.update(parameters)
+        self.time_variants.clear()
+        self.time_variants.update(time_variants)
+        self.outputs = None
+        self.derived_outputs = {"times": self.times}
+
     def store_derived_outputs_to_db(self):
         """
         currently inactive code to store outputs to sql database as they are created
@@ -918,13 +1059,13 @@ class EpiModel:
         apply all flow types sequentially to a vector of zeros
         note that deaths must come before births in case births replace deaths
 
-        :param _ode_equations: list
-            comes in as a list of zeros with length equal to that of the number of compartments for integration
+        :param _ode_equations: numpy.ndarray
+            comes in as a float array of zeros with length equal to that of the number of compartments for integration
         :param _compartment_values: numpy.ndarray
             working values of the compartment sizes
         :param _time: float
             current integration time
-        :return: ode equations as list
+        :return: ode equations as numpy.ndarray
             updated ode equations in same format but with all flows implemented
         """
         if self.ticker:
@@ -948,14 +1089,13 @@ class EpiModel:
 
         :parameters and return: see previous method apply_all_flow_types_to_odes
         """
-        for n_flow in self.transition_indices_to_implement:
-            net_flow = self.find_net_transition_flow(n_flow, _time, _compartment_values)
+        net_flows = numpy.array([self.find_net_transition_flow(n_flow, _time, _compartment_values)
+                                 for n_flow in self.transition_indices_to_implement], dtype=float)
 
-            # update equations
-            _ode_equations = increment_list_by_index(
-                _ode_equations, self.compartment_names.index(self.transition_flows.origin[n_flow]), -net_flow)
-            _ode_equations = increment_list_by_index(
-                _ode_equations, self.compartment_names.index(self.transition_flows.to[n_flow]), net_flow)
+        # update equations, equivalent to multiplying the net flows through by the sparse flow incidence matrix
+        _ode_equations += \
+            numpy.bincount(self.transition_to_indices, weights=net_flows, minlength=len(_ode_equations)) - \
+            numpy.bincount(self.transition_origin_indices, weights=net_flows, minlength=len(_ode_equations))
 
         # return flow rates
         return _ode_equations
@@ -975,7 +1115,7 @@ class EpiModel:
         """
 
         # find adjusted parameter value
-        parameter_value = self.get_parameter_value(self.transition_flows.parameter[n_flow], _time)
+        parameter_value = self.get_parameter_value(self.transition_flow_columns["parameter"][n_flow], _time)
 
         # the flow is null if the parameter is null
         if parameter_value == 0.:
@@ -985,11 +1125,11 @@ class EpiModel:
         infectious_population = self.find_infectious_multiplier(n_flow)
 
         # find the index of the origin or from compartment
-        from_compartment = self.compartment_names.index(self.transition_flows.origin[n_flow])
+        from_compartment = self.compartment_indices[self.transition_flow_columns["origin"][n_flow]]
 
         # implement flows according to whether customised or standard/infection-related
         return parameter_value * self.customised_flow_functions[n_flow](self, n_flow, _time, _compartment_values) if \
-            self.transition_flows.type[n_flow] == "customised_flows" else \
+            self.transition_flow_columns["type"][n_flow] == "customised_flows" else \
             parameter_value * _compartment_values[from_compartment] * infectious_population
 
     def apply_compartment_death_flows(self, _ode_equations, _compartment_values, _time):
@@ -1001,7 +1141,7 @@ class EpiModel:
         for n_flow in self.death_indices_to_implement:
             net_flow = self.find_net_infection_death_flow(n_flow, _time, _compartment_values)
             _ode_equations = increment_list_by_index(
-                _ode_equations, self.compartment_names.index(self.death_flows.origin[n_flow]), -net_flow)
+                _ode_equations, self.compartment_indices[self.death_flow_columns["origin"][n_flow]], -net_flow)
             if "total_deaths" in self.tracked_quantities:
                 self.tracked_quantities["total_deaths"] += net_flow
         return _ode_equations
@@ -1017,8 +1157,8 @@ class EpiModel:
         :param _compartment_values: list
             list of current compartment sizes
         """
-        return self.get_parameter_value(self.death_flows.parameter[_n_flow], _time) * \
-            _compartment_values[self.compartment_names.index(self.death_flows.origin[_n_flow])]
+        return self.get_parameter_value(self.death_flow_columns["parameter"][_n_flow], _time) * \
+            _compartment_values[self.compartment_indices[self.death_flow_columns["origin"][_n_flow]]]
 
     def apply_universal_death_flow(self, _ode_equations, _compartment_values, _time):
         """
@@ -1055,7 +1195,7 @@ class EpiModel:
 
         :parameters and return: see previous method apply_all_flow_types_to_odes
         """
-        return increment_list_by_index(_ode_equations, self.compartment_names.index(self.entry_compartment),
+        return increment_list_by_index(_ode_equations, self.compartment_indices[self.entry_compartment],
                                        self.find_total_births(_compartment_values, _time))
 
     def find_total_births(self, _compartment_values, _time):
@@ -1087,9 +1227,9 @@ class EpiModel:
             the total infectious quantity, whether that be the number or proportion of infectious persons
             needs to return as one for flows that are not transmission dynamic infectiousness flows
         """
-        if self.transition_flows.type[n_flow] == "infection_density":
+        if self.transition_flow_columns["type"][n_flow] == "infection_density":
             return self.infectious_populations
-        elif self.transition_flows.type[n_flow] == "infection_frequency":
+        elif self.transition_flow_columns["type"][n_flow] == "infection_frequency":
             return self.infectious_populations / self.infectious_denominators
         else:
             return 1.0
@@ -1156,7 +1296,7 @@ class EpiModel:
             self.derived_outputs[output] = [0.0] * len(self.times)
             transition_indices = self.find_output_transition_indices(output)
             for n_time, time in enumerate(self.times):
-                self.restore_past_state(time)
+                self.restore_past_state(time, n_time)
                 for n_flow in transition_indices:
                     net_flow = self.find_net_transition_flow(n_flow, time, self.compartment_values)
                     self.derived_outputs[output][n_time] += net_flow
@@ -1171,7 +1311,7 @@ class EpiModel:
         self.derived_outputs[category_name] = [0.0] * len(self.times)
         death_indices = self.find_output_death_indices(death_output)
         for n_time, time in enumerate(self.times):
-            self.restore_past_state(time)
+            self.restore_past_state(time, n_time)
             for n_flow in death_indices:
                 net_flow = self.find_net_infection_death_flow(n_flow, time, self.compartment_values)
                 self.derived_outputs[category_name][n_time] += net_flow
@@ -1183,10 +1323,10 @@ class EpiModel:
         for output in self.derived_output_functions:
             self.derived_outputs[output] = [0.0] * len(self.times)
             for n_time, time in enumerate(self.times):
-                self.restore_past_state(time)
+                self.restore_past_state(time, n_time)
                 self.derived_outputs[output][n_time] = self.derived_output_functions[output](self, time)
 
-    def restore_past_state(self, time):
+    def restore_past_state(self, time, time_index=None):
         """
         return compartment values and tracked quantities to the values current at a particular time during model
             integration from the returned outputs structure
@@ -1194,8 +1334,11 @@ class EpiModel:
 
         :param time: float
             time point to go back to
+        :param time_index: int
+            position of the time point within the times attribute, if already known by the calling method, which
+                avoids searching through all the integration times for every time point
         """
-        self.compartment_values = self.outputs[self.times.index(time)]
+        self.compartment_values = self.outputs[list(self.times).index(time) if time_index is None else time_index]
         self.update_tracked_quantities(self.compartment_values)
 
     def find_output_transition_indices(self, output):
@@ -1251,6 +1394,9 @@ class EpiModel:
         :param multiplier: float
             scalar value to multiply the compartment values by
         """
+
+        # only import plotting library when needed, so that models run without plotting don't pay the import cost
+        import matplotlib.pyplot
         matplotlib.pyplot.plot(self.times, multiplier * self.get_total_compartment_size(compartment_tags))
         matplotlib.pyplot.show()
 
@@ -1268,6 +1414,10 @@ class StratifiedModel(EpiModel):
         keys are all the stratification names implemented so far. values are the list of strata for each stratification
     :attribute available_death_rates: list
         single strata names for which population_wide mortality will be adjusted (or over-written)
+    :attribute change_flow_details: dict
+        keys are the indices of the strata equilibration (strata_change) flows to be implemented
+        values are tuples of the stratification, restriction, origin and destination strata, and origin and destination
+            compartment indices for the flow, extracted before integration
     :attribute compartment_types_to_stratify: list
         the compartments that are being stratified at this round of model stratification
     :attribute final_parameter_functions: dict
@@ -1325,6 +1475,10 @@ class StratifiedModel(EpiModel):
     :attribute parameter_components: dict
         keys for the name of each transition parameter, values the list of functions needed to recursively create the
             functions to create these parameter values
+    :attribute parameter_cache: dict
+        keys are the names of the parameters already evaluated at parameter_cache_time, values their values at that time
+    :attribute parameter_cache_time: float
+        the integration time at which the values currently held in parameter_cache were calculated
     :attribute parameters: dict
         same format as for EpiModel, but described here again given the other parameter-related attributes
         unprocessed parameters, which may be either float values or strings pointing to the keys of adaptation functions
@@ -1336,12 +1490,12 @@ class StratifiedModel(EpiModel):
     :attribute strain_mixing_elements: dict
         first tier of keys is strains
         second tier of keys is mixing categories
-        content of lists at lowest/third tier is the indices of the compartments that are relevant to this strain and
-            category
+        content of integer arrays at lowest/third tier is the indices of the compartments that are relevant to this
+            strain and category
     :attribute strain_mixing_multipliers: dict
         first tier of keys is strains
         second tier of keys is mixing categories
-        content of lists at lowest/third tier is the final infectiousness multiplier for the compartments for this
+        content of arrays at lowest/third tier is the final infectiousness multiplier for the compartments for this
             strain and category
     :attribute strains: list
         the strata to the strains stratification with specific behaviour
@@ -1409,10 +1563,11 @@ class StratifiedModel(EpiModel):
             self.adaptation_functions, self.infectiousness_levels, self.infectious_indices, \
             self.infectious_compartments, self.infectiousness_multipliers, self.parameter_components, \
             self.mortality_components, self.infectious_populations, self.strain_mixing_elements, \
-            self.strain_mixing_multipliers, self.strata_indices, self.target_props, self.cumulative_target_props = \
-            ({} for _ in range(16))
+            self.strain_mixing_multipliers, self.strata_indices, self.target_props, self.cumulative_target_props, \
+            self.change_flow_details, self.parameter_cache = ({} for _ in range(18))
         self.overwrite_character, self.overwrite_key = "W", "overwrite"
-        self.heterogeneous_mixing, self.mixing_matrix, self.available_death_rates, = False, None, [""]
+        self.heterogeneous_mixing, self.mixing_matrix, self.available_death_rates, self.parameter_cache_time = \
+            False, None, [""], None
         self.parameters["strata_equilibration_parameter"] = 0.01
 
 
@@ -1462,7 +1617,7 @@ class StratifiedModel(EpiModel):
             self.set_ageing_rates(strata_names)
 
         # retain copy of compartment names in their stratified form to refer back to during stratification process
-        self.unstratified_compartment_names = copy.copy(self.compartment_names)
+        self.unstratified_compartment_names = list(self.compartment_names)
 
         # stratify the compartments
         requested_proportions = self.prepare_starting_proportions(strata_names, requested_proportions)
@@ -1574,6 +1729,9 @@ class StratifiedModel(EpiModel):
                              "in order to apply to all compartments")
         elif not all([isinstance(stratum, (int, float)) for stratum in _strata_names]):
             raise ValueError("inputs for age strata breakpoints are not numeric")
+
+        # work on a new list, so that the user's request (which may be a tuple) is not changed by stratification
+        _strata_names = list(_strata_names)
         if 0 not in _strata_names:
             _strata_names.append(0)
             self.output_to_user("adding age stratum called '0' because not requested, which represents those aged " +
@@ -1699,14 +1857,14 @@ class StratifiedModel(EpiModel):
             self.output_to_user("ageing rate from age group %s to %s is %s"
                                 % (start_age, end_age, round(ageing_rate, self.reporting_sigfigs)))
             self.parameters[ageing_parameter_name] = ageing_rate
-            for compartment in self.compartment_names:
-                self.transition_flows = self.transition_flows.append(
-                    {"type": "standard_flows",
-                     "parameter": ageing_parameter_name,
-                     "origin": create_stratified_name(compartment, "age", start_age),
-                     "to": create_stratified_name(compartment, "age", end_age),
-                     "implement": len(self.all_stratifications)},
-                    ignore_index=True)
+            self.transition_flows = self.transition_flows.append(
+                [{"type": "standard_flows",
+                  "parameter": ageing_parameter_name,
+                  "origin": create_stratified_name(compartment, "age", start_age),
+                  "to": create_stratified_name(compartment, "age", end_age),
+                  "implement": len(self.all_stratifications)}
+                 for compartment in self.compartment_names],
+                ignore_index=True)
 
     def prepare_starting_proportions(self, _strata_names, _requested_proportions):
         """
@@ -1785,7 +1943,10 @@ class StratifiedModel(EpiModel):
                 find_stem(self.transition_flows.origin[n_flow]) in self.compartment_types_to_stratify,
                 find_stem(self.transition_flows.to[n_flow]) in self.compartment_types_to_stratify,
                 _adjustment_requests)
-        self.output_to_user("\n-----\nstratified transition flows matrix\n%s" % self.transition_flows)
+
+        # only build the string representation of the flows data frame if it is going to be displayed
+        if self.verbose:
+            self.output_to_user("\n-----\nstratified transition flows matrix\n%s" % self.transition_flows)
 
     def add_stratified_flows(
             self, _n_flow, _stratification_name, _strata_names, stratify_from, stratify_to, _adjustment_requests):
@@ -2027,6 +2188,7 @@ class StratifiedModel(EpiModel):
         :param _adjustment_requests:
             see incorporate_alternative_overwrite_approach and check_parameter_adjustment_requests
         """
+        new_flows = []
         for n_flow in self.find_death_indices_to_implement(back_one=1):
 
             # if the compartment with an additional death flow is being stratified
@@ -2039,19 +2201,22 @@ class StratifiedModel(EpiModel):
                     if not parameter_name:
                         parameter_name = self.death_flows.parameter[n_flow]
 
-                    # add the stratified flow to the death flows data frame
-                    self.death_flows = self.death_flows.append(
+                    # collect the stratified flow to add to the death flows data frame
+                    new_flows.append(
                         {"type": self.death_flows.type[n_flow],
                          "parameter": parameter_name,
                          "origin": create_stratified_name(self.death_flows.origin[n_flow], _stratification_name, stratum),
-                         "implement": len(self.all_stratifications)},
-                        ignore_index=True)
+                         "implement": len(self.all_stratifications)})
 
             # otherwise if not part of the stratification, accept the existing flow and increment the implement value
             else:
                 new_flow = self.death_flows.loc[n_flow, :].to_dict()
                 new_flow["implement"] += 1
-                self.death_flows = self.death_flows.append(new_flow, ignore_index=True)
+                new_flows.append(new_flow)
+
+        # add all the new flows at once, rather than copying the data frame for each one
+        if new_flows:
+            self.death_flows = self.death_flows.append(new_flows, ignore_index=True)
 
     def stratify_universal_death_rate(
             self, _stratification_name, _strata_names, _adjustment_requests, _compartment_types_to_stratify):
@@ -2218,18 +2383,22 @@ class StratifiedModel(EpiModel):
             _restriction: str
                 name of previously implemented stratum that this equilibration flow applies to, if any, otherwise "all"
         """
+        new_flows = []
         for compartment in self.unstratified_compartment_names:
             if _restriction in find_name_components(compartment) or _restriction == "all":
                 for n_stratum in range(len(_strata_names[: -1])):
-                    self.transition_flows = self.transition_flows.append(
+                    new_flows.append(
                         {"type": "strata_change",
                          "parameter": _stratification_name + "X" + _restriction + "X" + _strata_names[n_stratum] +
                          "_" + _strata_names[n_stratum + 1],
                          "origin": create_stratified_name(compartment, _stratification_name, _strata_names[n_stratum]),
                          "to": create_stratified_name(compartment, _stratification_name, _strata_names[n_stratum + 1]),
                          "implement": len(self.all_stratifications),
-                         "strain": float("nan")},
-                        ignore_index=True)
+                         "strain": float("nan")})
+
+        # add all the new flows at once, rather than copying the data frame for each one
+        if new_flows:
+            self.transition_flows = self.transition_flows.append(new_flows, ignore_index=True)
 
     """
     pre-integration methods
@@ -2239,11 +2408,17 @@ class StratifiedModel(EpiModel):
         """
         methods that can be run prior to integration to save various function calls being made at every time step
         """
+        self.compartment_indices = self.find_compartment_indices()
         self.prepare_stratified_parameter_calculations()
         self.prepare_infectiousness_calculations()
+        self.transition_flow_columns, self.death_flow_columns = \
+            self.transition_flows.to_dict(), self.death_flows.to_dict()
         self.transition_indices_to_implement = self.find_transition_indices_to_implement()
+        self.transition_origin_indices, self.transition_to_indices = self.find_transition_compartment_indices()
         self.death_indices_to_implement = self.find_death_indices_to_implement()
         self.change_indices_to_implement = self.find_change_indices_to_implement()
+        self.change_flow_details = self.find_change_flow_details()
+        self.parameter_cache, self.parameter_cache_time = {}, None
 
         # ensure there is a universal death rate available even if the model hasn't been stratified at all
         if len(self.all_stratifications) == 0 and isinstance(self.parameters["universal_death_rate"], (float, int)):
@@ -2255,13 +2430,18 @@ class StratifiedModel(EpiModel):
         self.find_strata_indices()
 
     def find_strata_indices(self):
+        """
+        find the indices of the compartments that fall within each stratum of each stratification
+        """
+
+        # decompose each compartment name once, rather than once for every stratum of every stratification
+        compartment_components = [set(find_name_components(compartment)) for compartment in self.compartment_names]
         for stratif in self.all_stratifications:
             self.strata_indices[stratif] = {}
-            for i_stratum, stratum in enumerate(self.all_stratifications[stratif]):
+            for stratum in self.all_stratifications[stratif]:
+                stratum_name = create_stratum_name(stratif, stratum, joining_string="")
                 self.strata_indices[stratif][stratum] = \
-                    [i_comp for i_comp in range(len(self.compartment_names)) if
-                     create_stratum_name(stratif, self.all_stratifications[stratif][i_stratum], joining_string="") in
-                     find_name_components(self.compartment_names[i_comp])]
+                    [i_comp for i_comp, components in enumerate(compartment_components) if stratum_name in components]
 
     def prepare_stratified_parameter_calculations(self):
         """
@@ -2335,21 +2515,26 @@ class StratifiedModel(EpiModel):
         """
         self.final_parameter_functions["universal_death_rateX" + _compartment] = \
             self.adaptation_functions[_sub_parameters[0]]
+        constant_multiplier, time_variant_functions = 1., []
         for component in _sub_parameters[1:]:
 
-            # get the new function to act on the less stratified function (closer to the "tree-trunk")
+            # collate constant adjustments into a single multiplier, so that only one function is needed for all of them
             if component not in self.parameters:
                 raise ValueError("parameter component %s not found in parameters attribute" % component)
             elif type(self.parameters[component]) == float:
-                update_function = create_multiplicative_function(self.parameters[component])
+                constant_multiplier *= self.parameters[component]
+
+            # collect the functions to act on the less stratified function (closer to the "tree-trunk")
             elif type(self.parameters[component]) == str:
-                update_function = create_time_variant_multiplicative_function(self.adaptation_functions[component])
+                time_variant_functions.append(self.adaptation_functions[component])
             else:
                 raise ValueError("parameter component %s not appropriate format" % component)
 
-            # create the composite function
-            self.final_parameter_functions["universal_death_rateX" + _compartment] = create_function_of_function(
-                update_function, self.final_parameter_functions["universal_death_rateX" + _compartment])
+        # apply all the adjustments within a single function
+        if time_variant_functions or constant_multiplier != 1.:
+            self.final_parameter_functions["universal_death_rateX" + _compartment] = create_product_function(
+                self.final_parameter_functions["universal_death_rateX" + _compartment], time_variant_functions,
+                constant_multiplier)
 
     def find_transition_components(self, _parameter):
         """
@@ -2387,22 +2572,26 @@ class StratifiedModel(EpiModel):
         elif type(self.parameters[_sub_parameters[0]]) == str:
             self.final_parameter_functions[_parameter] = self.adaptation_functions[_sub_parameters[0]]
 
-        # then cycle through other applicable components and extend function recursively, only if component available
+        # then cycle through other applicable components and collect their adjustments, only if component available
+        constant_multiplier, time_variant_functions = 1., []
         for component in _sub_parameters[1:]:
 
-            # get the new function to act on the less stratified function (closer to the "tree-trunk")
+            # collate constant adjustments into a single multiplier, so that only one function is needed for all of them
             if component not in self.parameters:
                 raise ValueError("parameter component %s not found in parameters attribute" % component)
             elif isinstance(self.parameters[component], float):
-                update_function = create_multiplicative_function(self.parameters[component])
+                constant_multiplier *= self.parameters[component]
+
+            # collect the functions to act on the less stratified function (closer to the "tree-trunk")
             elif type(self.parameters[component]) == str:
-                update_function = create_time_variant_multiplicative_function(self.adaptation_functions[component])
+                time_variant_functions.append(self.adaptation_functions[component])
             else:
                 raise ValueError("parameter component %s not appropriate format" % component)
 
-            # create the composite function
-            self.final_parameter_functions[_parameter] = create_function_of_function(
-                update_function, self.final_parameter_functions[_parameter])
+        # apply all the adjustments within a single function
+        if time_variant_functions or constant_multiplier != 1.:
+            self.final_parameter_functions[_parameter] = create_product_function(
+                self.final_parameter_functions[_parameter], time_variant_functions, constant_multiplier)
 
     def prepare_infectiousness_calculations(self):
         """
@@ -2503,15 +2692,19 @@ class StratifiedModel(EpiModel):
         find the relevant indices to be used to calculate the force of infection contribution to each strain from each
             mixing category as a list of indices - and separately find multipliers as a list of the same length for
             their relative infectiousness extracted from self.infectiousness_multipliers
+        stored as numpy arrays so that the infectious population can be found with a single dot product during
+            integration
         """
         for strain in self.strains + ["all_strains"]:
             self.strain_mixing_elements[strain], self.strain_mixing_multipliers[strain] = {}, {}
             for category in ["all_population"] if self.mixing_matrix is None else self.mixing_categories:
-                self.strain_mixing_elements[strain][category] = \
-                    [index for index in mixing_indices[category] if index in self.infectious_indices[strain]]
-                self.strain_mixing_multipliers[strain][category] = \
+                self.strain_mixing_elements[strain][category] = numpy.array(
+                    [index for index in mixing_indices[category] if index in self.infectious_indices[strain]],
+                    dtype=int)
+                self.strain_mixing_multipliers[strain][category] = numpy.array(
                     [self.infectiousness_multipliers[i_comp]
-                     for i_comp in self.strain_mixing_elements[strain][category]]
+                     for i_comp in self.strain_mixing_elements[strain][category]],
+                    dtype=float)
 
     def find_transition_indices_to_implement(self, back_one=0, include_change=False):
         """
@@ -2543,6 +2736,26 @@ class StratifiedModel(EpiModel):
                 self.transition_flows.type[i_flow] == "strata_change" and
                 self.transition_flows.implement[i_flow] == len(self.all_stratifications) - back_one]
 
+    def find_change_flow_details(self):
+        """
+        split out the components of the parameter name for each equilibration flow to be implemented and find the
+            indices of the compartments it links, so that this is only done once before integration
+
+        :return: dict
+            see change_flow_details attribute
+        """
+        change_flow_details = {}
+        for i_change in self.change_indices_to_implement:
+
+            # split out the components of the transition string, which follow the standard 6-character string "change"
+            stratification, restriction, transition = find_name_components(self.transition_flows.parameter[i_change])
+            origin_stratum, to_stratum = transition.split("_")
+            change_flow_details[i_change] = \
+                (stratification, restriction, origin_stratum, to_stratum,
+                 self.compartment_indices[self.transition_flows.origin[i_change]],
+                 self.compartment_indices[self.transition_flows.to[i_change]])
+        return change_flow_details
+
     def find_death_indices_to_implement(self, back_one=0):
         """
         find all the indices of the death flows that need to be stratified
@@ -2564,6 +2777,8 @@ class StratifiedModel(EpiModel):
         """
         returns a parameter value by calling the function represented by its string within the parameter_functions
             attribute
+        values are cached for the current time, so that each parameter function is only called once per time point no
+            matter how many flows or outputs use it
 
         :param _parameter: str
             name of the parameter to be called (key to the parameter_functions dictionary)
@@ -2572,7 +2787,11 @@ class StratifiedModel(EpiModel):
         :return: float
             the parameter value needed
         """
-        return self.final_parameter_functions[_parameter](_time)
+        if _time != self.parameter_cache_time:
+            self.parameter_cache, self.parameter_cache_time = {}, _time
+        if _parameter not in self.parameter_cache:
+            self.parameter_cache[_parameter] = self.final_parameter_functions[_parameter](_time)
+        return self.parameter_cache[_parameter]
 
     def find_infectious_population(self, _compartment_values):
         """
@@ -2583,13 +2802,12 @@ class StratifiedModel(EpiModel):
             current values for the compartment sizes
         """
         mixing_categories = ["all_population"] if self.mixing_matrix is None else self.mixing_categories
+        compartment_array = numpy.asarray(_compartment_values)
         for strain in self.strains if self.strains else ["all_strains"]:
-            self.infectious_populations[strain] = []
-            for category in mixing_categories:
-                self.infectious_populations[strain].append(sum(
-                    element_list_multiplication(
-                        [_compartment_values[i_comp] for i_comp in self.strain_mixing_elements[strain][category]],
-                        self.strain_mixing_multipliers[strain][category])))
+            self.infectious_populations[strain] = \
+                [numpy.dot(compartment_array[self.strain_mixing_elements[strain][category]],
+                           self.strain_mixing_multipliers[strain][category])
+                 for category in mixing_categories]
         self.infectious_denominators = sum(_compartment_values)
 
     def find_infectious_multiplier(self, n_flow):
@@ -2602,13 +2820,17 @@ class StratifiedModel(EpiModel):
             the total infectious quantity, whether that is the number or proportion of infectious persons
             needs to return as one for flows that are not transmission dynamic infectiousness flows
         """
-        if "infection" not in self.transition_flows.type[n_flow]:
+        if "infection" not in self.transition_flow_columns["type"][n_flow]:
             return 1.0
-        strain = "all_strains" if not self.strains else self.transition_flows.strain[n_flow]
-        mixing_elements = [1.0] if self.mixing_matrix is None else \
-            list(self.mixing_matrix[self.transition_flows.force_index[n_flow], :])
-        denominator = 1.0 if "_density" in self.transition_flows.type[n_flow] else self.infectious_denominators
-        return sum(element_list_multiplication(self.infectious_populations[strain], mixing_elements)) / denominator
+        strain = "all_strains" if not self.strains else self.transition_flow_columns["strain"][n_flow]
+        denominator = 1.0 if "_density" in self.transition_flow_columns["type"][n_flow] else \
+            self.infectious_denominators
+
+        # weight the infectious populations of each mixing category by the mixing matrix row applicable to the flow
+        if self.mixing_matrix is None:
+            return self.infectious_populations[strain][0] / denominator
+        return numpy.dot(self.mixing_matrix[self.transition_flow_columns["force_index"][n_flow], :],
+                         self.infectious_populations[strain]) / denominator
 
     def get_compartment_death_rate(self, _compartment, _time):
         """
@@ -2646,7 +2868,7 @@ class StratifiedModel(EpiModel):
 
             # apply to that compartment
             _ode_equations = increment_list_by_index(
-                _ode_equations, self.compartment_names.index(compartment), total_births * entry_fraction)
+                _ode_equations, self.compartment_indices[compartment], total_births * entry_fraction)
         return _ode_equations
 
     def apply_change_rates(self, _ode_equations, _compartment_values, _time):
@@ -2662,38 +2884,36 @@ class StratifiedModel(EpiModel):
                 current integration time value
         """
 
+        # target and current distributions only depend on the stratification and restriction, so share between flows
+        strata_props = {}
+
         # for each change flow being implemented
         for i_change in self.change_indices_to_implement:
+            stratification, restriction, origin_stratum, to_stratum, origin_index, to_index = \
+                self.change_flow_details[i_change]
 
-            # split out the components of the transition string, which follow the standard 6-character string "change"
-            stratification, restriction, transition = find_name_components(self.transition_flows.parameter[i_change])
-            origin_stratum, to_stratum = transition.split("_")
-
-            # find the distribution of the population across strata to be targeted
-            _cumulative_target_props = self.find_target_strata_props(_time, restriction, stratification)
-
-            # find the proportional distribution of the population across strata at the current time point
-            _cumulative_strata_props = self.find_current_strata_props(_compartment_values, stratification, restriction)
+            # find the distribution of the population across strata to be targeted and the proportional distribution
+            #   of the population across strata at the current time point
+            if (stratification, restriction) not in strata_props:
+                strata_props[(stratification, restriction)] = \
+                    (self.find_target_strata_props(_time, restriction, stratification),
+                     self.find_current_strata_props(_compartment_values, stratification, restriction))
+            _cumulative_target_props, _cumulative_strata_props = strata_props[(stratification, restriction)]
 
             # work out which stratum and compartment transitions should be going from and to
             if _cumulative_strata_props[origin_stratum] > _cumulative_target_props[origin_stratum]:
-                take_stratum, take_compartment, give_compartment = \
-                    origin_stratum, self.transition_flows.origin[i_change], self.transition_flows.to[i_change]
+                take_stratum, take_index, give_index = origin_stratum, origin_index, to_index
             else:
-                take_stratum, take_compartment, give_compartment = \
-                    to_stratum, self.transition_flows.to[i_change], self.transition_flows.origin[i_change]
+                take_stratum, take_index, give_index = to_stratum, to_index, origin_index
 
             # find net flow
             net_flow = \
                 numpy.log(_cumulative_strata_props[take_stratum] / _cumulative_target_props[take_stratum]) / \
-                self.parameters["strata_equilibration_parameter"] * \
-                _compartment_values[self.compartment_names.index(take_compartment)]
+                self.parameters["strata_equilibration_parameter"] * _compartment_values[take_index]
 
             # update equations
-            _ode_equations = increment_list_by_index(
-                _ode_equations, self.compartment_names.index(take_compartment), -net_flow)
-            _ode_equations = increment_list_by_index(
-                _ode_equations, self.compartment_names.index(give_compartment), net_flow)
+            _ode_equations = increment_list_by_index(_ode_equations, take_index, -net_flow)
+            _ode_equations = increment_list_by_index(_ode_equations, give_index, net_flow)
         return _ode_equations
 
     def find_target_strata_props(self, _time, _restriction, _stratification):
@@ -2746,20 +2966,24 @@ class StratifiedModel(EpiModel):
                 if this is submitted as "all", the equilibration will be applied across all other strata
         """
 
+        compartment_array = numpy.asarray(_compartment_values)
+
         # find the compartment indices applicable to the cross-stratification of interest (which may be all of them)
         if _restriction == "all":
-            restriction_compartments = list(range(len(self.compartment_names)))
+            restriction_compartments = None
+            restriction_total = compartment_array.sum()
         else:
             restrict_stratification, restrict_stratum = _restriction.split("_")
-            restriction_compartments = self.strata_indices[restrict_stratification][restrict_stratum]
+            restriction_compartments = set(self.strata_indices[restrict_stratification][restrict_stratum])
+            restriction_total = compartment_array[list(restriction_compartments)].sum()
 
         # find current values of prevalence for the stratification for which prevalence values targeted
         current_strata_props = {}
         for stratum in self.all_stratifications[_stratification]:
-            current_strata_props[stratum] = \
-                sum([_compartment_values[i_comp] for i_comp in restriction_compartments if
-                     i_comp in self.strata_indices[_stratification][stratum]]) / \
-                sum([_compartment_values[i_comp] for i_comp in restriction_compartments])
+            stratum_compartments = self.strata_indices[_stratification][stratum] if restriction_compartments is None \
+                else [i_comp for i_comp in self.strata_indices[_stratification][stratum]
+                      if i_comp in restriction_compartments]
+            current_strata_props[stratum] = compartment_array[stratum_compartments].sum() / restriction_total
 
         return create_cumulative_dict(current_strata_props)
 